@@ -1,127 +1,136 @@
-from spase_model.spase_2_6_0 import (
-    AccessInformation,
-    AccessInformationOptional,
-    AccessRights,
-    AccessUrl,
-    Annotation,
-    AnnotationType,
-    ApplicationInterface,
-    Association,
-    AssociationType,
-    Availability,
-    AzimuthalAngleRange,
-    Bin,
-    BoundaryConditions,
-    Catalog,
-    Checksum,
-    ClassificationMethod,
-    Collection,
-    ConfidenceRating,
-    Contact,
-    CoordinateRepresentation,
-    CoordinateSystem,
-    CoordinateSystemName,
-    DataExtent,
-    DiagnosisTimeStep,
-    DisplayData,
-    DisplayOutput,
-    DisplayType,
-    Document,
-    DocumentType,
-    Element,
-    Encoding,
-    EnergyRange,
-    ExecutionEnvironment,
-    Extension,
-    FieldQuantity,
-    FieldType,
-    Format,
-    FrequencyRange,
-    Funding,
-    Granule,
-    HashFunction,
-    InformationUrl,
-    InputField,
-    InputParameter,
-    InputPopulation,
-    InputProcess,
-    InputProperties,
-    InputProperty,
-    Installer,
-    Instrument,
-    InstrumentType,
-    Location,
-    MassRange,
-    MeasurementType,
-    Member,
-    Mixed,
-    MixedQuantity,
-    Model,
-    ModelDomain,
-    ModeledRegion,
-    ModelRun,
-    ModelSpecification,
-    ModelTime,
-    ModelType,
-    ModelVersion,
-    NumericalData,
-    NumericalOutput,
-    ObservationExtent,
-    Observatory,
-    OperatingSpan,
-    OutputParameters,
-    OutputProperty,
-    Parameter,
-    ParameterQuantity,
-    Particle,
-    ParticleQuantity,
-    ParticleType,
-    Person,
-    PhenomenonType,
-    PitchAngleRange,
-    PolarAngleRange,
-    ProcCoeffType,
-    ProcessingLevel,
-    ProcessType,
-    Product,
-    Property,
-    PublicationInfo,
-    Qualifier,
-    Region,
-    RegionParameter,
-    Registry,
-    RenderingAxis,
-    RenderingHints,
-    Repository,
-    ResourceHeader,
-    RevisionEvent,
-    RevisionHistory,
-    Role,
-    SavedQuantity,
-    ScaleType,
-    Service,
-    Software,
-    Source,
-    SourceType,
-    Spase,
-    SpatialCoverage,
-    SpatialDescription,
-    SpectralRange,
-    Structure,
-    Style,
-    Support,
-    SupportQuantity,
-    Symmetry,
-    TemporalDescription,
-    TimeSpan,
-    Version,
-    Versions,
-    Wave,
-    WavelengthRange,
-    WaveQuantity,
-    WaveType,
-    Yn,
-)
+"""Model classes generated by xsdata
+
+The classes are loaded from spase_model.spase_2_6_0 the first time one of them is accessed, so importing the
+package itself does not pay for building all of the model's dataclasses.
+"""
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from spase_model.spase_2_6_0 import (
+        AccessInformation,
+        AccessInformationOptional,
+        AccessRights,
+        AccessUrl,
+        Annotation,
+        AnnotationType,
+        ApplicationInterface,
+        Association,
+        AssociationType,
+        Availability,
+        AzimuthalAngleRange,
+        Bin,
+        BoundaryConditions,
+        Catalog,
+        Checksum,
+        ClassificationMethod,
+        Collection,
+        ConfidenceRating,
+        Contact,
+        CoordinateRepresentation,
+        CoordinateSystem,
+        CoordinateSystemName,
+        DataExtent,
+        DiagnosisTimeStep,
+        DisplayData,
+        DisplayOutput,
+        DisplayType,
+        Document,
+        DocumentType,
+        Element,
+        Encoding,
+        EnergyRange,
+        ExecutionEnvironment,
+        Extension,
+        FieldQuantity,
+        FieldType,
+        Format,
+        FrequencyRange,
+        Funding,
+        Granule,
+        HashFunction,
+        InformationUrl,
+        InputField,
+        InputParameter,
+        InputPopulation,
+        InputProcess,
+        InputProperties,
+        InputProperty,
+        Installer,
+        Instrument,
+        InstrumentType,
+        Location,
+        MassRange,
+        MeasurementType,
+        Member,
+        Mixed,
+        MixedQuantity,
+        Model,
+        ModelDomain,
+        ModeledRegion,
+        ModelRun,
+        ModelSpecification,
+        ModelTime,
+        ModelType,
+        ModelVersion,
+        NumericalData,
+        NumericalOutput,
+        ObservationExtent,
+        Observatory,
+        OperatingSpan,
+        OutputParameters,
+        OutputProperty,
+        Parameter,
+        ParameterQuantity,
+        Particle,
+        ParticleQuantity,
+        ParticleType,
+        Person,
+        PhenomenonType,
+        PitchAngleRange,
+        PolarAngleRange,
+        ProcCoeffType,
+        ProcessingLevel,
+        ProcessType,
+        Product,
+        Property,
+        PublicationInfo,
+        Qualifier,
+        Region,
+        RegionParameter,
+        Registry,
+        RenderingAxis,
+        RenderingHints,
+        Repository,
+        ResourceHeader,
+        RevisionEvent,
+        RevisionHistory,
+        Role,
+        SavedQuantity,
+        ScaleType,
+        Service,
+        Software,
+        Source,
+        SourceType,
+        Spase,
+        SpatialCoverage,
+        SpatialDescription,
+        SpectralRange,
+        Structure,
+        Style,
+        Support,
+        SupportQuantity,
+        Symmetry,
+        TemporalDescription,
+        TimeSpan,
+        Version,
+        Versions,
+        Wave,
+        WavelengthRange,
+        WaveQuantity,
+        WaveType,
+        Yn,
+    )
 
 __all__ = [
     "AccessInformation",
@@ -247,3 +256,21 @@ __all__ = [
     "WavelengthRange",
     "Yn",
 ]
+
+_MODULES = ("spase_2_6_0",)
+
+
+def __getattr__(name):
+    if name in _MODULES:
+        return importlib.import_module(f".{name}", __name__)
+    if name in __all__:
+        for module_name in _MODULES:
+            module = importlib.import_module(f".{module_name}", __name__)
+            globals().update({class_name: getattr(module, class_name) for class_name in __all__
+                              if hasattr(module, class_name)})
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
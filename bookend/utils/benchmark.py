@@ -0,0 +1,380 @@
+"""Benchmarks for the SPASE to RDF conversion tools
+
+Run from the bookend directory, e.g. ``python -m utils.benchmark``. Results are printed as JSON.
+"""
+import argparse
+import dataclasses
+import importlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from enum import Enum
+from typing import get_args, get_origin, get_type_hints
+
+import rdflib
+import xsdata
+from rdflib import Graph
+from xsdata.formats.dataclass.parsers import XmlParser
+from xsdata.formats.dataclass.serializers import XmlSerializer
+from xsdata.formats.dataclass.serializers.config import SerializerConfig
+from xsdata.formats.dataclass.models.generics import DerivedElement
+from xsdata.models.datatype import XmlDateTime, XmlDuration
+
+from .spase_to_rdf import _add_new_triples, _shard_graph, create_owl_from_python_module, get_xml_parser, iter_obj_triples, \
+    mint_resource_uri, parse_xml_file, project_xml_file, rdfize_obj
+
+SAMPLE_RECORD = "./data/spase-data/spase-record.xml"
+SCHEMA_FILE = "./data/spase-2.6.0.xsd"
+
+
+def _time_per_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark_parse(xml_file=SAMPLE_RECORD, module="spase_model", repeat=50):
+    """Times parse_xml_file per record with a fresh XmlParser per file and with the shared parser"""
+    spase_class = getattr(importlib.import_module(module), 'Spase')
+    # Warm up the shared parser so both runs measure steady-state parsing
+    parse_xml_file(xml_file, spase_class, get_xml_parser())
+
+    fresh = _time_per_call(lambda: parse_xml_file(xml_file, spase_class, XmlParser()), repeat)
+    shared = _time_per_call(lambda: parse_xml_file(xml_file, spase_class), repeat)
+    return {
+        "xml_file": xml_file,
+        "repeat": repeat,
+        "fresh_parser_seconds_per_record": fresh,
+        "shared_parser_seconds_per_record": shared,
+        "speedup": fresh / shared,
+    }
+
+
+def benchmark_project(xml_file=SAMPLE_RECORD, module="spase_model", repeat=200):
+    """Times extracting the ResourceHeader fields of a record with project_xml_file against a full parse_xml_file"""
+    spase_class = getattr(importlib.import_module(module), 'Spase')
+    parse_xml_file(xml_file, spase_class)
+
+    full = _time_per_call(lambda: parse_xml_file(xml_file, spase_class), repeat)
+    projected = _time_per_call(lambda: project_xml_file(xml_file), repeat)
+    return {
+        "xml_file": xml_file,
+        "repeat": repeat,
+        "full_parse_seconds_per_record": full,
+        "projection_seconds_per_record": projected,
+        "speedup": full / projected,
+    }
+
+
+def _set_resource_ids(record, suffix):
+    """Gives the top-level resources of a parsed record distinct resource ids, to fake a corpus from one record"""
+    for resources in vars(record).values():
+        for resource in resources if isinstance(resources, list) else [resources]:
+            if hasattr(resource, "resource_id"):
+                resource.resource_id = f"{resource.resource_id.split('#')[0]}#{suffix}"
+
+
+def _insert_per_triple(record, g):
+    for triple in iter_obj_triples(record):
+        g.add(triple)
+
+
+def _insert_addn(record, g):
+    triples = list(iter_obj_triples(record))
+    g.addN((s, p, o, g) for s, p, o in triples)
+
+
+def _insert_new_triples(record, g):
+    _add_new_triples(g, iter_obj_triples(record))
+
+
+INSERT_STRATEGIES = {
+    # One Graph.add per triple into the default store, as rdfize_obj does
+    "per_triple_add": (_insert_per_triple, Graph),
+    "rdfize_obj": (rdfize_obj, Graph),
+    "addn_default_store": (_insert_addn, Graph),
+    # What xml_to_rdf does for Turtle shards
+    "addn_shard_graph": (_insert_new_triples, _shard_graph),
+}
+
+
+def _insertion_throughput(record, records, shard_records, insert, new_graph):
+    triple_count = 0
+    g = new_graph()
+    start = time.perf_counter()
+    for i in range(records):
+        _set_resource_ids(record, i)
+        insert(record, g)
+        if (i + 1) % shard_records == 0:
+            triple_count += len(g)
+            g = new_graph()
+    triple_count += len(g)
+    return triple_count / (time.perf_counter() - start)
+
+
+def benchmark_rdfize(xml_file=SAMPLE_RECORD, module="spase_model", records=10000, shard_records=1000,
+                     sample_repeat=200):
+    """Measures RDF-ization throughput in triples per second for each way of inserting the triples
+
+    'sample_record' RDF-izes the sample record repeatedly into one graph; 'synthetic_corpus' RDF-izes
+    `records` copies of it with distinct resource ids, starting a new graph every `shard_records`.
+    """
+    spase_class = getattr(importlib.import_module(module), 'Spase')
+    record = parse_xml_file(xml_file, spase_class)
+    results = {"xml_file": xml_file, "records": records, "shard_records": shard_records}
+    for corpus, count, per_shard in (("sample_record", sample_repeat, sample_repeat),
+                                     ("synthetic_corpus", records, shard_records)):
+        results[corpus] = {
+            f"{name}_triples_per_second": _insertion_throughput(record, count, per_shard, insert, new_graph)
+            for name, (insert, new_graph) in INSERT_STRATEGIES.items()
+        }
+    results["resource_uri_cache"] = mint_resource_uri.cache_info()._asdict()
+    return results
+
+
+XSD = "{http://www.w3.org/2001/XMLSchema}"
+
+
+def _schema_constraints(xsd_file):
+    """Returns the required elements and the choice groups of each complex type in an XSD, by type name
+
+    The generated dataclasses flatten choices into independent optional fields, and do not mark every
+    element with minOccurs >= 1 as required, so the generator takes both from the schema itself.
+    """
+    constraints = {}
+    for complex_type in ET.parse(xsd_file).getroot().iter(XSD + "complexType"):
+        required = {element.get("name") for sequence in complex_type.iter(XSD + "sequence")
+                    for element in sequence.findall(XSD + "element") if element.get("minOccurs", "1") != "0"}
+        choices = [([element.get("name") for element in choice.findall(XSD + "element")],
+                    choice.get("minOccurs", "1") != "0")
+                   for choice in complex_type.iter(XSD + "choice")]
+        constraints[complex_type.get("name")] = (required, choices)
+    return constraints
+
+
+class SyntheticRecordGenerator:
+    """Builds random, schema-valid SPASE records from the model dataclasses
+
+    Every required element is filled, and each optional one with probability optional_fill while the record is
+    less than max_depth levels deep; exactly one element of each required choice is picked. Lists get 1 to
+    list_size items. Resource ids are unique, and the other *_id references point into a pool of
+    shared_references ids per kind, like the repositories and contacts that real records share.
+    """
+
+    def __init__(self, module="spase_model", max_depth=4, list_size=3, shared_references=50, optional_fill=0.5,
+                 seed=0, xsd_file=SCHEMA_FILE):
+        self.module = importlib.import_module(module)
+        self.constraints = _schema_constraints(xsd_file)
+        self.max_depth = max_depth
+        self.list_size = list_size
+        self.shared_references = shared_references
+        self.optional_fill = optional_fill
+        self.rng = random.Random(seed)
+        self.resource_count = 0
+        spase_class = getattr(self.module, 'Spase')
+        # One resource of a random kind per record
+        hints = get_type_hints(spase_class)
+        self.resource_fields = [field.name for field in dataclasses.fields(spase_class)
+                                if dataclasses.is_dataclass(self._item_type(hints[field.name]))]
+        self.version = next(iter(self._item_type(hints['version'])))
+
+    def _is_model_class(self, t):
+        return isinstance(t, type) and t.__module__ == getattr(self.module, 'Spase').__module__
+
+    @staticmethod
+    def _item_type(type_hint):
+        args = [t for t in get_args(type_hint) if t is not type(None)]
+        return args[0] if args else type_hint
+
+    def record(self):
+        """Returns a new Spase record holding one resource"""
+        spase_class = getattr(self.module, 'Spase')
+        resource_field = self.rng.choice(self.resource_fields)
+        resource_class = self._item_type(get_type_hints(spase_class)[resource_field])
+        return spase_class(version=self.version, **{resource_field: [self.instance(resource_class, 1)]})
+
+    def instance(self, clazz, depth):
+        hints = get_type_hints(clazz)
+        required, choices = self.constraints.get(getattr(getattr(clazz, 'Meta', None), 'name', clazz.__name__),
+                                                 (set(), []))
+        required = set(required)
+        excluded = set()
+        for names, choice_required in choices:
+            excluded.update(names)
+            if choice_required or depth < self.max_depth and self.rng.random() < self.optional_fill:
+                required.add(self.rng.choice(names))
+        values = {}
+        for field in dataclasses.fields(clazz):
+            name = field.metadata.get('name')
+            if name not in required and not field.metadata.get('required') and \
+                    (field.metadata.get('type') == 'Wildcard' or name in excluded or depth >= self.max_depth or
+                     self.rng.random() >= self.optional_fill):
+                continue
+            type_hint = hints[field.name]
+            item_type = self._item_type(type_hint)
+            if get_origin(type_hint) is list:
+                count = max(field.metadata.get('min_occurs', 1), self.rng.randint(1, self.list_size))
+                values[field.name] = [self.value(field, item_type, depth) for _ in range(count)]
+            else:
+                values[field.name] = self.value(field, item_type, depth)
+        return clazz(**values)
+
+    def value(self, field, t, depth):
+        if isinstance(t, type) and issubclass(t, Enum):
+            return self.rng.choice(list(t))
+        if self._is_model_class(t):
+            return self.instance(t, depth + 1)
+        if field.name == 'resource_id':
+            self.resource_count += 1
+            return f"spase://Synthetic/Resource/R{self.resource_count:08d}"
+        if 'pattern' in field.metadata:
+            kind = "".join(x.capitalize() for x in field.name.replace("_id", "").split("_"))
+            return f"spase://Synthetic/{kind}/{kind}{self.rng.randrange(self.shared_references):04d}"
+        if t is XmlDateTime:
+            return XmlDateTime(2000 + self.rng.randrange(25), self.rng.randint(1, 12), self.rng.randint(1, 28),
+                               self.rng.randrange(24), self.rng.randrange(60), self.rng.randrange(60), offset=0)
+        if t is XmlDuration:
+            return XmlDuration(f"PT{self.rng.randint(1, 3600)}S")
+        if t is bool:
+            return self.rng.random() < 0.5
+        if t is int:
+            return self.rng.randrange(1000)
+        if t is float:
+            return round(self.rng.uniform(-1000, 1000), 3)
+        if field.name == 'lang':
+            return "en"
+        return f"{field.name} {self.rng.randrange(10 ** 6)}"
+
+
+def write_synthetic_corpus(output_path, records, module="spase_model", **generator_options):
+    """Writes records synthetic SPASE XML files to output_path, returning their paths and total size in bytes"""
+    generator = SyntheticRecordGenerator(module, **generator_options)
+    serializer = XmlSerializer(config=SerializerConfig(indent="  "))
+    xml_files = []
+    total_bytes = 0
+    for i in range(records):
+        xml_file = os.path.join(output_path, f"synthetic_{i:06d}.xml")
+        # The generated Spase class has no namespace of its own, so the root is given the schema's qualified name
+        record = DerivedElement(qname="{http://www.spase-group.org/data/schema}Spase", value=generator.record())
+        xml = serializer.render(record, ns_map={None: "http://www.spase-group.org/data/schema"})
+        with open(xml_file, "w", encoding="utf-8") as f:
+            total_bytes += f.write(xml)
+        xml_files.append(xml_file)
+    return xml_files, total_bytes
+
+
+def benchmark_synthetic(module="spase_model", records=1000, max_depth=4, list_size=3, shared_references=50,
+                        optional_fill=0.5, seed=0):
+    """Times parsing, RDF-izing and serializing a synthetic corpus, and generating the OWL ontology"""
+    spase_class = getattr(importlib.import_module(module), 'Spase')
+    generator_options = dict(max_depth=max_depth, list_size=list_size, shared_references=shared_references,
+                             optional_fill=optional_fill, seed=seed)
+    results = {"module": module, "records": records, **generator_options}
+    with tempfile.TemporaryDirectory() as corpus_path:
+        start = time.perf_counter()
+        xml_files, results["corpus_bytes"] = write_synthetic_corpus(corpus_path, records, module, **generator_options)
+        results["generate_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parsed = [parse_xml_file(xml_file, spase_class) for xml_file in xml_files]
+        results["parse_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        triples = [triple for record in parsed for triple in iter_obj_triples(record, deterministic_ids=True)]
+        results["rdfize_seconds"] = time.perf_counter() - start
+        results["triples"] = len(triples)
+
+        start = time.perf_counter()
+        g = _shard_graph()
+        g.addN((s, p, o, g) for s, p, o in triples)
+        turtle = g.serialize(format='turtle', encoding='utf-8')
+        results["serialize_seconds"] = time.perf_counter() - start
+        results["turtle_bytes"] = len(turtle)
+
+        start = time.perf_counter()
+        create_owl_from_python_module(module, os.path.join(corpus_path, "spase.owl"))
+        results["owl_seconds"] = time.perf_counter() - start
+
+    results["parse_records_per_second"] = records / results["parse_seconds"]
+    results["rdfize_triples_per_second"] = results["triples"] / results["rdfize_seconds"]
+    results["serialize_triples_per_second"] = results["triples"] / results["serialize_seconds"]
+    return results
+
+
+def _subprocess_seconds(code, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def benchmark_import(module="spase_model", repeat=7):
+    """Times importing the model package in a fresh interpreter, net of interpreter startup
+
+    'eager' imports the generated module itself, which is what importing the package used to do.
+    """
+    startup = _subprocess_seconds("pass", repeat)
+    package = _subprocess_seconds(f"import {module}", repeat) - startup
+    root_class = _subprocess_seconds(f"from {module} import Spase", repeat) - startup
+    eager = _subprocess_seconds(f"import {module}; import {module}.spase_2_6_0", repeat) - startup
+    return {
+        "module": module,
+        "repeat": repeat,
+        "interpreter_startup_seconds": startup,
+        "package_import_seconds": package,
+        "spase_class_import_seconds": root_class,
+        "eager_import_seconds": eager,
+    }
+
+
+BENCHMARKS = {
+    "parse": benchmark_parse,
+    "project": benchmark_project,
+    "import": benchmark_import,
+    "rdfize": benchmark_rdfize,
+    "synthetic": benchmark_synthetic,
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    arg_parser.add_argument("--output", help="also write the results to this JSON file")
+    synthetic = arg_parser.add_argument_group("synthetic corpus")
+    synthetic.add_argument("--records", type=int, default=1000)
+    synthetic.add_argument("--max-depth", type=int, default=4)
+    synthetic.add_argument("--list-size", type=int, default=3)
+    synthetic.add_argument("--shared-references", type=int, default=50)
+    synthetic.add_argument("--optional-fill", type=float, default=0.5)
+    synthetic.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        arg_parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    options = {"synthetic": dict(records=args.records, max_depth=args.max_depth, list_size=args.list_size,
+                                 shared_references=args.shared_references, optional_fill=args.optional_fill,
+                                 seed=args.seed)}
+    results = {
+        "environment": {"python": platform.python_version(), "rdflib": rdflib.__version__,
+                        "xsdata": xsdata.__version__, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        **{name: BENCHMARKS[name](**options.get(name, {})) for name in args.benchmarks or BENCHMARKS},
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,39 @@
-import glob
+import ast
+import bz2
+import gzip
+import hashlib
+import heapq
 import importlib
+import io
+import json
+import pickle
+import shutil
 import subprocess
 import os
+import tracemalloc
 import uuid
 import warnings
+import xml.etree.ElementTree as ET
+from urllib.parse import quote
 from enum import Enum
 from pathlib import Path
-from typing import List, Optional
-from rdflib import Graph, URIRef, Literal, RDF, RDFS, OWL, XSD, BNode, DC
-from rdflib.collection import Collection
+from typing import List, NamedTuple, Optional, get_args, get_origin
+from rdflib import Dataset, Graph, URIRef, Literal, RDF, RDFS, OWL, XSD, BNode, DC
+from rdflib.plugins.serializers.nquads import _nq_row
+from rdflib.plugins.serializers.nt import _nt_row
+import dataclasses
 import inspect
 import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from functools import lru_cache
 
 from tqdm import tqdm
 from xsdata.exceptions import ConverterWarning
+from xsdata.formats.dataclass.context import XmlContext
 from xsdata.formats.dataclass.parsers import XmlParser
 
 PY_TO_XSD_TYPES = {
@@ -31,6 +51,9 @@ PY_TO_XSD_TYPES = {
     List[bool]: XSD.boolean
 }
 
+# Namespace for the name-based UUIDs of nested nodes when deterministic IRIs are requested
+SPASE_NODE_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "http://www.spase-group.org/data/schema/")
+
 XS_DATA_TYPES_MAP = {
     "XmlDate": XSD.date,
     "XmlDateTime": XSD.dateTime,
@@ -38,13 +61,26 @@ XS_DATA_TYPES_MAP = {
     "XmlDuration": XSD.duration,
 }
 
+# Characters of a resource id that are replaced by '_' in its IRI
+RESOURCE_ID_TRANSLATION = str.maketrans({'/': '_', ' ': '_', '.': '_'})
+RESOURCE_URI_CACHE_SIZE = 1 << 16
+
+
+MODEL_BUILD_FILE = '.xsdata_build.json'
+
+
+def create_python_model_from_xsd(xsd_file_path, output_module, generator_options=(), force=False):
+    """Creates Python model from XSD file using xsdata
 
-def create_python_model_from_xsd(xsd_file_path, output_module):
-    """Creates Python model from XSD file using xsdata"""
+    The build is recorded in MODEL_BUILD_FILE in the package, keyed by the XSD content hash, the xsdata version
+    and the generator options, and is skipped while none of them has changed and the generated files are still
+    there (or unless force=True). Returns True for such a cache hit and False if the model was generated.
+    """
     # Check if xsdata is installed
     try:
         # Check if the xsdata command is available
-        subprocess.run(["xsdata", "--version"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        xsdata_version = subprocess.run(["xsdata", "--version"], check=True, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, text=True).stdout.strip()
     except FileNotFoundError:
         print("xsdata is not installed. Please install xsdata to use this function.")
         return
@@ -54,19 +90,99 @@ def create_python_model_from_xsd(xsd_file_path, output_module):
         print(f"XSD file not found: {xsd_file_path}")
         return
 
+    build_key = {'xsd_sha256': _file_sha256(xsd_file_path), 'xsdata_version': xsdata_version,
+                 'generator_options': list(generator_options)}
+    build_path = os.path.join(output_module, MODEL_BUILD_FILE)
+    if not force and os.path.exists(build_path):
+        with open(build_path) as f:
+            build = json.load(f)
+        if build['key'] == build_key and all(os.path.exists(os.path.join(output_module, name))
+                                             for name in build['files']):
+            print(f"Python model in {output_module} is up to date (cache hit)")
+            return True
+
     # Create the output directory if it doesn't exist
     os.makedirs(output_module, exist_ok=True)
 
     # Generate Python code from XSD file using xsdata
-    subprocess.run(["xsdata", "generate", "-p", output_module, xsd_file_path], check=True)
+    subprocess.run(["xsdata", "generate", "-p", output_module, *generator_options, xsd_file_path], check=True)
 
+    write_lazy_package_init(output_module)
+    files = sorted(name for name in os.listdir(output_module) if name.endswith('.py'))
+    _write_json(build_path, {'key': build_key, 'files': files})
     print(f"Python model created in: {output_module}")
+    return False
+
+
+LAZY_INIT_TEMPLATE = '''"""Model classes generated by xsdata
+
+The classes are loaded from {modules} the first time one of them is accessed, so importing the
+package itself does not pay for building all of the model's dataclasses.
+"""
+import importlib
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+{imports}
 
-def create_owl_from_python_module(python_module_name: str, output_file):
-    """Creates OWL Ontology using python module"""
-    g = Graph()
+__all__ = [
+{names}
+]
+
+_MODULES = ({submodules})
+
+
+def __getattr__(name):
+    if name in _MODULES:
+        return importlib.import_module(f".{{name}}", __name__)
+    if name in __all__:
+        for module_name in _MODULES:
+            module = importlib.import_module(f".{{module_name}}", __name__)
+            globals().update({{class_name: getattr(module, class_name) for class_name in __all__
+                              if hasattr(module, class_name)}})
+        return globals()[name]
+    raise AttributeError(f"module {{__name__!r}} has no attribute {{name!r}}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+'''
+
+
+def write_lazy_package_init(output_module):
+    """Rewrites the __init__.py xsdata generates, which imports every class eagerly, to load them on first access
+
+    Leaves the file alone if it has no top-level imports of the generated modules, e.g. when it is already lazy.
+    """
+    init_path = os.path.join(output_module, '__init__.py')
+    with open(init_path) as f:
+        tree = ast.parse(f.read())
+    package = os.path.basename(os.path.normpath(output_module))
+    imports = [node for node in tree.body
+               if isinstance(node, ast.ImportFrom) and (node.module or '').startswith(f"{package}.")]
+    if not imports:
+        return
+    names = [name for node in tree.body if isinstance(node, ast.Assign)
+             and any(isinstance(target, ast.Name) and target.id == '__all__' for target in node.targets)
+             for name in ast.literal_eval(node.value)]
+    submodules = [node.module[len(package) + 1:] for node in imports]
+    import_lines = []
+    for node in imports:
+        import_lines.append(f"    from {node.module} import (")
+        import_lines.extend(f"        {alias.name}," for alias in node.names)
+        import_lines.append("    )")
+    with open(init_path, 'w') as f:
+        f.write(LAZY_INIT_TEMPLATE.format(
+            modules=', '.join(f"{package}.{submodule}" for submodule in submodules),
+            imports='\n'.join(import_lines), names='\n'.join(f'    "{name}",' for name in names),
+            submodules=''.join(f'"{submodule}", ' for submodule in submodules).rstrip(' ')))
 
+
+def iter_owl_triples(python_module_name: str):
+    """Yields the triples of the OWL Ontology of a python module straight from its classes
+
+    Properties shared by several classes are yielded once per class, so the triples can repeat.
+    """
     external_module = importlib.import_module(python_module_name)
     # Iterate over classes in the module
     for name, obj in inspect.getmembers(external_module, inspect.isclass):
@@ -77,9 +193,9 @@ def create_owl_from_python_module(python_module_name: str, output_file):
             subject_uri = URIRef(f"http://www.spase-group.org/data/schema/{obj.__name__}")
 
             # Add type triple
-            g.add((subject_uri, RDF.type, URIRef(f"http://www.w3.org/2002/07/owl#Class")))
-            g.add((subject_uri, RDFS.label, Literal(obj.__name__)))
-            g.add((subject_uri, RDFS.comment, Literal(obj.__doc__)))
+            yield subject_uri, RDF.type, URIRef(f"http://www.w3.org/2002/07/owl#Class")
+            yield subject_uri, RDFS.label, Literal(obj.__name__)
+            yield subject_uri, RDFS.comment, Literal(obj.__doc__)
 
             # Add triples for each dataclass field
             for field_name, field in obj.__dataclass_fields__.items():
@@ -92,191 +208,1570 @@ def create_owl_from_python_module(python_module_name: str, output_file):
                         target = "".join(x.capitalize() for x in field_name.replace("_id", "").lower().split("_"))
                         object_property_name = "has_" + field_name[:1].lower() + field_name[1:].replace("_id", "")
                         object_property = URIRef(f"http://www.spase-group.org/data/schema/{object_property_name}")
-                        g.add((object_property, RDFS.subPropertyOf, OWL.topObjectProperty))
-                        g.add((object_property, RDFS.label, Literal(object_property_name)))
-                        g.add((object_property, RDFS.domain, subject_uri))
-                        g.add((object_property, RDFS.range,
-                               URIRef(f"http://www.spase-group.org/data/schema/{target}")))
+                        yield object_property, RDFS.subPropertyOf, OWL.topObjectProperty
+                        yield object_property, RDFS.label, Literal(object_property_name)
+                        yield object_property, RDFS.domain, subject_uri
+                        yield object_property, RDFS.range, URIRef(f"http://www.spase-group.org/data/schema/{target}")
                     else:
                         matches = re.search(r"\[([^\]]+)\]", str(obj.__annotations__[field_name]))
                         target = matches.group(1).split('.')[-1] if matches else str(obj.__annotations__[field_name])
                         if target in ["float", "int", "str", "bool", "<class 'str'>"] or target in XS_DATA_TYPES_MAP:
                             data_property_name = field_name[:1].lower() + field_name[1:]
                             data_property = URIRef(f"http://www.spase-group.org/data/schema/{data_property_name}")
-                            g.add((data_property, RDFS.subPropertyOf, OWL.topDataProperty))
-                            g.add((data_property, RDFS.label, Literal(data_property_name)))
-                            g.add((data_property, RDFS.domain, subject_uri))
+                            yield data_property, RDFS.subPropertyOf, OWL.topDataProperty
+                            yield data_property, RDFS.label, Literal(data_property_name)
+                            yield data_property, RDFS.domain, subject_uri
                             target_type = PY_TO_XSD_TYPES[obj.__annotations__[field_name]] if obj.__annotations__[
                                                                                                   field_name] in PY_TO_XSD_TYPES else \
                                 XS_DATA_TYPES_MAP[target]
-                            g.add((data_property, RDFS.range, URIRef(target_type)))
+                            yield data_property, RDFS.range, URIRef(target_type)
                         else:
                             object_property_name = "has_" + field_name[:1].lower() + field_name[1:]
                             object_property = URIRef(f"http://www.spase-group.org/data/schema/{object_property_name}")
-                            g.add((object_property, RDFS.subPropertyOf, OWL.topObjectProperty))
-                            g.add((object_property, RDFS.label, Literal(object_property_name)))
-                            g.add((object_property, RDFS.domain, subject_uri))
-                            g.add((object_property, RDFS.range,
-                                   URIRef(f"http://www.spase-group.org/data/schema/{target}")))
+                            yield object_property, RDFS.subPropertyOf, OWL.topObjectProperty
+                            yield object_property, RDFS.label, Literal(object_property_name)
+                            yield object_property, RDFS.domain, subject_uri
+                            yield object_property, RDFS.range, URIRef(
+                                f"http://www.spase-group.org/data/schema/{target}")
         else:
             subject_uri = URIRef(f"http://www.spase-group.org/data/schema/{obj.__name__}")
             list_node = BNode()
             # Add type triple
-            g.add((subject_uri, RDF.type, OWL.Class))
-            g.add((subject_uri, RDFS.label, Literal(obj.__name__)))
-            g.add((subject_uri, RDFS.comment, Literal(obj.__doc__)))
+            yield subject_uri, RDF.type, OWL.Class
+            yield subject_uri, RDFS.label, Literal(obj.__name__)
+            yield subject_uri, RDFS.comment, Literal(obj.__doc__)
             for enum_name in list(obj.__members__.keys()):
-                g.add((URIRef(f"http://www.spase-group.org/data/schema/{enum_name}"), RDF.type, OWL.NamedIndividual))
-                g.add((URIRef(f"http://www.spase-group.org/data/schema/{enum_name}"), RDF.type, subject_uri))
-                g.add((URIRef(f"http://www.spase-group.org/data/schema/{enum_name}"), RDFS.label,
-                       Literal(obj.__members__[enum_name].value)))
-            collection = Collection(g, list_node, [URIRef(f"http://www.spase-group.org/data/schema/{name}") for name in
-                                                   list(obj.__members__.keys())])
-            g.add((subject_uri, OWL.oneOf, list_node))
-    # Serialize the RDF graph to a file
-    g.add((URIRef("http://www.spase-group.org/data/schema/"), RDF.type, OWL.Ontology))
-    g.add((URIRef("http://www.spase-group.org/data/schema/"), RDFS.label, Literal("Spase Group Ontology")))
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", category=UserWarning)
-        g.serialize(destination=output_file, format='pretty-xml')
-
-
-def rdfize_obj(obj, g: Graph, obj_uuid=''):
-    obj_uri = ''
-    obj_name = ''
-    if hasattr(obj, "resource_id"):
-        obj_name = str(obj.resource_id.strip().replace('spase://', '')).replace('/', '_').replace(" ", "_").replace('.',
-                                                                                                                    '_')
-        obj_uri = URIRef(f"http://www.spase-group.org/data/schema/{obj_name}")
-        g.add((obj_uri, DC.identifier, Literal(str(obj.resource_id))))
+                yield URIRef(f"http://www.spase-group.org/data/schema/{enum_name}"), RDF.type, OWL.NamedIndividual
+                yield URIRef(f"http://www.spase-group.org/data/schema/{enum_name}"), RDF.type, subject_uri
+                yield URIRef(f"http://www.spase-group.org/data/schema/{enum_name}"), RDFS.label, \
+                    Literal(obj.__members__[enum_name].value)
+            # The owl:oneOf RDF list of the members, as rdflib's Collection would build it
+            node = list_node
+            for i, enum_name in enumerate(obj.__members__.keys()):
+                yield node, RDF.first, URIRef(f"http://www.spase-group.org/data/schema/{enum_name}")
+                next_node = BNode() if i + 1 < len(obj.__members__) else RDF.nil
+                yield node, RDF.rest, next_node
+                node = next_node
+            yield subject_uri, OWL.oneOf, list_node
+    yield URIRef("http://www.spase-group.org/data/schema/"), RDF.type, OWL.Ontology
+    yield URIRef("http://www.spase-group.org/data/schema/"), RDFS.label, Literal("Spase Group Ontology")
+
+
+OWL_FORMATS = ('pretty-xml', 'xml', 'turtle', 'nt')
+OWL_BUILD_SUFFIX = '.build.json'
+
+
+def model_fingerprint(python_module_name: str):
+    """Hashes the source files of a model module and the signatures of its classes (fields and enum members)"""
+    module = importlib.import_module(python_module_name)
+    # Only the classes defined in the module, or in the modules of a package, not those it imports (e.g. XmlDateTime)
+    classes = [(name, clazz) for name, clazz in inspect.getmembers(module, inspect.isclass)
+               if clazz.__module__ == module.__name__ or clazz.__module__.startswith(f"{module.__name__}.")]
+    sha256 = hashlib.sha256()
+    for source_file in sorted({module.__file__} | {inspect.getsourcefile(clazz) for _, clazz in classes}):
+        sha256.update(Path(source_file).read_bytes())
+    for name, clazz in classes:
+        if issubclass(clazz, Enum):
+            signature = [f"{member.name} = {member.value!r}" for member in clazz]
+        elif dataclasses.is_dataclass(clazz):
+            signature = [f"{field.name}: {field.type}" for field in dataclasses.fields(clazz)]
+        else:
+            continue
+        sha256.update(f"{name}({', '.join(signature)})".encode())
+    return sha256.hexdigest()
+
+
+def owl_generator_version():
+    """Hashes the code that maps model classes to OWL, so a changed mapping invalidates earlier builds"""
+    return hashlib.sha256((inspect.getsource(iter_owl_triples) + repr(XS_DATA_TYPES_MAP)).encode()).hexdigest()
+
+
+def create_owl_from_python_module(python_module_name: str, output_file, output_format='pretty-xml', force=False):
+    """Creates OWL Ontology using python module
+
+    output_format is 'pretty-xml' (the default), 'xml', 'turtle' or 'nt'. The nested pretty-xml layout is by far
+    the slowest to write; 'nt' skips the Graph and writes the triples as iter_owl_triples yields them.
+
+    The model_fingerprint of the module, the owl_generator_version and the classes and properties of the ontology
+    are kept next to it in output_file + OWL_BUILD_SUFFIX, and while those and the format match, an existing
+    output_file is left as it is (unless force=True). Returns whether that was the case, and the classes and
+    properties added and removed since the previous build.
+    """
+    if output_format not in OWL_FORMATS:
+        raise ValueError(f"Unsupported OWL format: {output_format}")
+    fingerprint = model_fingerprint(python_module_name)
+    generator = owl_generator_version()
+    build_path = f"{output_file}{OWL_BUILD_SUFFIX}"
+    build = {'classes': [], 'properties': []}
+    if os.path.exists(build_path):
+        with open(build_path) as f:
+            build = json.load(f)
+        if not force and os.path.exists(output_file) and build['fingerprint'] == fingerprint and \
+                build.get('generator') == generator and build['output_format'] == output_format:
+            print(f"OWL ontology {output_file} is up to date (cache hit)")
+            return {'cache_hit': True, 'classes': len(build['classes']), 'properties': len(build['properties'])}
+
+    triples = list(dict.fromkeys(iter_owl_triples(python_module_name)))
+    if output_format == 'nt':
+        with NTriplesWriter(output_file) as writer:
+            writer.write_triples(triples)
     else:
-        obj_uuid = str(uuid.uuid4()) if obj_uuid == '' else obj_uuid
-        obj_uri = URIRef(f"http://www.spase-group.org/data/schema/{obj.__class__.__name__}-{obj_uuid}")
-        obj_name = f"{obj.__class__.__name__}-{obj_uuid}"
-
-    class_uri = URIRef(f"http://www.spase-group.org/data/schema/{obj.__class__.__name__}")
-    g.add((obj_uri, RDF.type, class_uri))
-    g.add((obj_uri, RDFS.label, Literal(obj_name)))
-    for member_name, member_value in vars(obj).items():
-        if issubclass(member_value.__class__, Enum):
-            # print('im enum')
-            pass
+        g = Graph(store='SimpleMemory')
+        g.addN((s, p, o, g) for s, p, o in triples)
+        # Serialize the RDF graph to a file
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=UserWarning)
+            g.serialize(destination=output_file, format=output_format)
+
+    classes = sorted({str(s) for s, p, o in triples if p == RDF.type and o == OWL.Class})
+    properties = sorted({str(s) for s, p, o in triples if p == RDFS.subPropertyOf})
+    _write_json(build_path, {'fingerprint': fingerprint, 'generator': generator, 'output_format': output_format,
+                             'classes': classes, 'properties': properties})
+    stats = {
+        'cache_hit': False,
+        'classes': len(classes),
+        'properties': len(properties),
+        'added_classes': sorted(set(classes) - set(build['classes'])),
+        'removed_classes': sorted(set(build['classes']) - set(classes)),
+        'added_properties': sorted(set(properties) - set(build['properties'])),
+        'removed_properties': sorted(set(build['properties']) - set(properties)),
+    }
+    print(f"OWL ontology {output_file}: {len(classes)} classes ({len(stats['added_classes'])} added, "
+          f"{len(stats['removed_classes'])} removed), {len(properties)} properties "
+          f"({len(stats['added_properties'])} added, {len(stats['removed_properties'])} removed)")
+    return stats
+
+
+# Interned schema IRIs by local name, so equal terms are one object whose hash is computed once
+_SCHEMA_TERMS = {}
+
+
+def schema_term(name):
+    """Returns the interned IRI of a name in the SPASE schema namespace"""
+    term = _SCHEMA_TERMS.get(name)
+    if term is None:
+        term = _SCHEMA_TERMS[name] = URIRef(f"http://www.spase-group.org/data/schema/{name}")
+    return term
+
+
+@lru_cache(maxsize=None)
+def intern_model_terms(module_name):
+    """Pre-populates the schema terms with the class, field, predicate and enum member names of a model module"""
+    module = importlib.import_module(module_name)
+    for name, clazz in inspect.getmembers(module, inspect.isclass):
+        if clazz.__module__ != module.__name__:
+            continue
+        schema_term(name)
+        if issubclass(clazz, Enum):
+            for member in clazz:
+                schema_term(member.name)
+        elif dataclasses.is_dataclass(clazz):
+            for field in dataclasses.fields(clazz):
+                member_name = field.name[:1].lower() + field.name[1:]
+                schema_term(member_name)
+                schema_term(f"has_{member_name}")
+                if field.name.endswith("_id") and field.name != "prior_id":
+                    schema_term("has_" + member_name.replace("_id", ""))
+                    schema_term("".join(x.capitalize() for x in field.name.replace("_id", "").lower().split("_")))
+    return len(_SCHEMA_TERMS)
+
+
+class _FieldPlan(NamedTuple):
+    """How rdfize_obj emits one dataclass field"""
+    name: str
+    object_predicate: Optional[URIRef]
+    id_predicate: Optional[URIRef]
+    id_class_uri: Optional[URIRef]
+    literal_predicate: URIRef
+    is_list: bool
+    literal_type: Optional[type]
+    literal_datatype: Optional[URIRef]
+
+
+def _hint_types(type_hint):
+    """Flattens Optional/List type hints into the types they wrap"""
+    args = get_args(type_hint)
+    if not args:
+        return [type_hint]
+    return [t for arg in args for t in _hint_types(arg)]
+
+
+def _literal_datatype(value):
+    return PY_TO_XSD_TYPES[type(value)] if type(value) in PY_TO_XSD_TYPES else \
+        XS_DATA_TYPES_MAP[str(value.__class__.__name__).replace("xsdata.models.datatype.", "")]
+
+
+@lru_cache(maxsize=None)
+def get_emission_plan(clazz):
+    """Returns the class URI and the per-field emission plan rdfize_obj walks for a model dataclass"""
+    intern_model_terms(clazz.__module__)
+    class_uri = schema_term(clazz.__name__)
+    field_plans = []
+    for field in dataclasses.fields(clazz):
+        member_name = field.name
+        type_hint = clazz.__annotations__.get(member_name)
+        types = [t for t in _hint_types(type_hint) if t is not type(None)]
+
+        object_predicate = None
+        if any(isinstance(t, type) and t.__module__ == clazz.__module__ and
+               (dataclasses.is_dataclass(t) or issubclass(t, Enum)) for t in types):
+            object_predicate = schema_term(f"has_{member_name[:1].lower() + member_name[1:]}")
+
+        id_predicate = None
+        id_class_uri = None
+        if member_name.endswith("_id") and member_name != "prior_id":
+            object_property_name = "has_" + member_name[:1].lower() + member_name[1:].replace("_id", "")
+            id_predicate = schema_term(object_property_name)
+            member_class = "".join(x.capitalize() for x in member_name.replace("_id", "").lower().split("_"))
+            id_class_uri = schema_term(member_class)
+
+        # The datatype is resolved from the hint once; values of any other type are looked up as they come
+        literal_type = types[0] if len(types) == 1 and isinstance(types[0], type) else None
+        literal_datatype = PY_TO_XSD_TYPES.get(literal_type) or XS_DATA_TYPES_MAP.get(getattr(literal_type, "__name__", ""))
+        if literal_datatype is None:
+            literal_type = None
+
+        field_plans.append(_FieldPlan(
+            name=member_name,
+            object_predicate=object_predicate,
+            id_predicate=id_predicate,
+            id_class_uri=id_class_uri,
+            literal_predicate=schema_term(member_name[:1].lower() + member_name[1:]),
+            is_list=get_origin(type_hint) is list,
+            literal_type=literal_type,
+            literal_datatype=literal_datatype,
+        ))
+    return class_uri, tuple(field_plans)
+
+
+@lru_cache(maxsize=RESOURCE_URI_CACHE_SIZE)
+def mint_resource_uri(resource_id):
+    """Returns the IRI of a resource id such as spase://SMWG/Repository/NASA/GSFC/SPDF
+
+    The same repositories, contacts and observatories are referenced by thousands of records, so the IRIs are
+    kept in an LRU cache; mint_resource_uri.cache_info() reports its hits and misses.
+    """
+    name = resource_id.strip().replace('spase://', '').translate(RESOURCE_ID_TRANSLATION)
+    return URIRef(f"http://www.spase-group.org/data/schema/{name}")
+
+
+def node_uuid(obj, deterministic_ids=False):
+    """Returns the UUID used in the IRI of a nested object without a resource_id
+
+    Deterministic ids are derived from the object's class and content, so unchanged records convert to the
+    same IRIs and identical sub-structures collapse into one node.
+    """
+    if deterministic_ids:
+        return str(uuid.uuid5(SPASE_NODE_NAMESPACE, repr(obj)))
+    return str(uuid.uuid4())
+
+
+def _walk(stack, deterministic_ids=False):
+    """Pops the stack until it is empty, yielding its triples and expanding the model objects on it
+
+    Objects still to be expanded are entries of the form (None, obj, obj_uuid); every other entry is a triple.
+    An object's nested members are pushed above the triples that link to them, so the order matches a
+    depth-first recursive walk.
+    """
+    while stack:
+        s, p, o = stack.pop()
+        if s is not None:
+            yield s, p, o
+            continue
+        obj, obj_uuid = p, o
+        if hasattr(obj, "resource_id"):
+            obj_uri = mint_resource_uri(obj.resource_id)
+            # Minted names contain no '/', so the label is the last path segment
+            obj_name = obj_uri.rsplit('/', 1)[1]
+            yield obj_uri, DC.identifier, Literal(str(obj.resource_id))
         else:
-            type_hint = obj.__class__.__annotations__.get(member_name)
-            # print(type_hint)
-            # print(f"Member: {member_name}, Value: {member_value}, Type: {type_hint}")
-            if "model.spase_2_6_0." in str(
-                    type_hint) and member_value is not None and member_value != [] and not isinstance(member_value,
-                                                                                                      str):
-                # print(f"a class {member_name}")
-                object_property_name = "has_" + member_name[:1].lower() + member_name[1:]
-                predicate_uri = URIRef(f"http://www.spase-group.org/data/schema/{object_property_name}")
-                if "List" in str(type_hint):
-                    for member in member_value:
-                        process_member(member, obj_uri, predicate_uri, g)
-                else:
-                    process_member(member_value, obj_uri, predicate_uri, g)
-            elif member_name.endswith("_id") and member_name != "prior_id" and member_value is not None:
-                object_property_name = "has_" + member_name[:1].lower() + member_name[1:].replace("_id", "")
-                if isinstance(member_value, list):
-                    for member_subvalue in member_value:
-                        member_uri = URIRef(
-                            f"http://www.spase-group.org/data/schema/{str(member_subvalue.strip().replace('spase://', '')).replace('/', '_').replace(' ', '_').replace('.', '_')}")
-                        predicate_uri = URIRef(f"http://www.spase-group.org/data/schema/{object_property_name}")
-                        member_class = "".join(
-                            x.capitalize() for x in member_name.replace("_id", "").lower().split("_"))
-                        g.add((member_uri, RDF.type, URIRef(f"http://www.spase-group.org/data/schema/{member_class}")))
-                        g.add((obj_uri, predicate_uri, URIRef(member_uri)))
-                else:
-                    member_uri = URIRef(
-                        f"http://www.spase-group.org/data/schema/{str(member_value.strip().replace('spase://', '')).replace('/', '_').replace(' ', '_').replace('.', '_')}")
-                    predicate_uri = URIRef(f"http://www.spase-group.org/data/schema/{object_property_name}")
-                    g.add((obj_uri, predicate_uri, URIRef(member_uri)))
-            elif member_value is not None:
-                object_property_name = member_name[:1].lower() + member_name[1:]
-                predicate_uri = URIRef(f"http://www.spase-group.org/data/schema/{object_property_name}")
+            obj_uuid = node_uuid(obj, deterministic_ids) if obj_uuid == '' else obj_uuid
+            obj_uri = URIRef(f"http://www.spase-group.org/data/schema/{obj.__class__.__name__}-{obj_uuid}")
+            obj_name = f"{obj.__class__.__name__}-{obj_uuid}"
+
+        class_uri, field_plans = get_emission_plan(obj.__class__)
+        yield obj_uri, RDF.type, class_uri
+        yield obj_uri, RDFS.label, Literal(obj_name)
+        pending = []
+        for field in field_plans:
+            member_value = getattr(obj, field.name)
+            if member_value is None or isinstance(member_value, Enum):
+                continue
+            # Values xsdata could not convert to a model class stay strings and are emitted as literals
+            if field.object_predicate is not None and member_value != [] and not isinstance(member_value, str):
+                for member in member_value if field.is_list else (member_value,):
+                    pending.extend(_member_entries(member, obj_uri, field.object_predicate, deterministic_ids))
+            elif field.id_predicate is not None:
                 if isinstance(member_value, list):
                     for member_subvalue in member_value:
-                        data_type = PY_TO_XSD_TYPES[type(member_subvalue)] if type(
-                            member_subvalue) in PY_TO_XSD_TYPES else XS_DATA_TYPES_MAP[
-                            str(member_subvalue.__class__.__name__).replace("xsdata.models.datatype.", "")]
-                        g.add((obj_uri, predicate_uri, Literal(member_subvalue, datatype=data_type)))
+                        member_uri = mint_resource_uri(member_subvalue)
+                        pending.append((member_uri, RDF.type, field.id_class_uri))
+                        pending.append((obj_uri, field.id_predicate, member_uri))
                 else:
-                    data_type = PY_TO_XSD_TYPES[type(member_value)] if type(member_value) in PY_TO_XSD_TYPES else \
-                        XS_DATA_TYPES_MAP[str(member_value.__class__.__name__).replace("xsdata.models.datatype.", "")]
-                    g.add((obj_uri, predicate_uri, Literal(member_value, datatype=data_type)))
+                    member_uri = mint_resource_uri(member_value)
+                    pending.append((obj_uri, field.id_predicate, member_uri))
+            elif isinstance(member_value, list):
+                for member_subvalue in member_value:
+                    data_type = field.literal_datatype if type(member_subvalue) is field.literal_type else \
+                        _literal_datatype(member_subvalue)
+                    pending.append((obj_uri, field.literal_predicate, Literal(member_subvalue, datatype=data_type)))
+            else:
+                data_type = field.literal_datatype if type(member_value) is field.literal_type else \
+                    _literal_datatype(member_value)
+                pending.append((obj_uri, field.literal_predicate, Literal(member_value, datatype=data_type)))
+        stack.extend(reversed(pending))
 
 
-def process_member(member, obj_uri, predicate_uri, g):
+def _member_entries(member, obj_uri, predicate_uri, deterministic_ids=False):
+    """Returns the stack entries for a member value: the member object to expand, if any, and the linking triple"""
     if hasattr(member.__class__, "__members__"):
-        g.add((obj_uri, predicate_uri, URIRef(
-            f"http://www.spase-group.org/data/schema/{member.name}")))
-        return
+        return [(obj_uri, predicate_uri, schema_term(member.name))]
     elif hasattr(member, "resource_id"):
-        member_name = str(member.resource_id.strip().replace('spase://', '')).replace('/', '_').replace(" ",
-                                                                                                        "_").replace(
-            '.', '_')
-        member_uri = URIRef(
-            f"http://www.spase-group.org/data/schema/{member_name}")
-        rdfize_obj(member, g, '')
-    else:
-        member_uuid = str(uuid.uuid4())
-        member_uri = URIRef(
-            f"http://www.spase-group.org/data/schema/{member.__class__.__name__}-{member_uuid}")
-        rdfize_obj(member, g, member_uuid)
-    g.add((obj_uri, predicate_uri, member_uri))
+        member_uri = mint_resource_uri(member.resource_id)
+        return [(None, member, ''), (obj_uri, predicate_uri, member_uri)]
+    member_uuid = node_uuid(member, deterministic_ids)
+    member_uri = URIRef(f"http://www.spase-group.org/data/schema/{member.__class__.__name__}-{member_uuid}")
+    return [(None, member, member_uuid), (obj_uri, predicate_uri, member_uri)]
 
 
-def parse_xml_file(xml_file_path, clazz):
+def iter_obj_triples(obj, obj_uuid='', deterministic_ids=False):
+    """Yields the triples of a model object and everything nested in it
+
+    The walk keeps an explicit stack instead of recursing, so it uses no Python frame per nesting level and
+    cannot hit the recursion limit on deeply nested records.
+    """
+    return _walk([(None, obj, obj_uuid)], deterministic_ids)
+
+
+def iter_member_triples(member, obj_uri, predicate_uri, deterministic_ids=False):
+    """Yields the triples linking obj_uri to a member value, and those of the member itself"""
+    return _walk(_member_entries(member, obj_uri, predicate_uri, deterministic_ids)[::-1], deterministic_ids)
+
+
+def rdfize_obj(obj, g: Graph, obj_uuid='', deterministic_ids=False):
+    """Adds the triples of a model object and everything nested in it to g, once all of them are collected
+
+    They are added one by one, which is faster than Graph.addN on both the default and the SimpleMemory store.
+    """
+    triples = list(iter_obj_triples(obj, obj_uuid, deterministic_ids))
+    for triple in triples:
+        g.add(triple)
+
+
+def process_member(member, obj_uri, predicate_uri, g, deterministic_ids=False):
+    """Adds the triples linking obj_uri to a member value, and those of the member itself, to g"""
+    triples = list(iter_member_triples(member, obj_uri, predicate_uri, deterministic_ids))
+    for triple in triples:
+        g.add(triple)
+
+
+@lru_cache(maxsize=None)
+def get_xml_parser():
+    """Returns the shared XmlParser, whose XmlContext keeps the model class metadata between files"""
+    return XmlParser(context=XmlContext())
+
+
+@lru_cache(maxsize=None)
+def _model_version(clazz):
+    """Fingerprints the model module of a class, so cached records are dropped when the model is regenerated"""
+    module = inspect.getmodule(clazz)
+    return hashlib.sha256(f"{module.__name__}:".encode() + Path(module.__file__).read_bytes()).hexdigest()
+
+
+class ParsedRecordCache:
+    """On-disk cache of parsed record trees, keyed by the XML content hash and the model version
+
+    Entries are pickled dataclass trees. Once the cache grows past max_bytes the least recently used
+    entries are evicted until it is back under LOW_WATER of max_bytes, so the directory is rescanned rarely.
+    """
+
+    LOW_WATER = 0.9
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_written = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, xml_string, clazz):
+        key = hashlib.sha256(f"{_model_version(clazz)}:{clazz.__qualname__}:".encode() + xml_string.encode())
+        key = key.hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + '.pickle')
+
+    def _entries(self):
+        for directory in os.scandir(self.cache_dir):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def get(self, xml_string, clazz):
+        path = self._path(xml_string, clazz)
+        try:
+            with open(path, 'rb') as f:
+                obj = pickle.load(f)
+        except Exception:
+            # Missing, evicted by another process, truncated or unpicklable entries are all just misses
+            self.misses += 1
+            return None
+        # Mark the entry as recently used, unless another process has evicted it since
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return obj
+
+    def put(self, xml_string, clazz, obj):
+        path = self._path(xml_string, clazz)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        self.bytes_written += size
+        self.account(size)
+
+    def account(self, nbytes):
+        """Counts nbytes written to the cache, also by copies of it in pool workers, evicting once it outgrows
+        max_bytes
+        """
+        self._size += nbytes
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits in LOW_WATER of max_bytes"""
+        # Other processes may share the directory, so measure it instead of trusting the running total
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_bytes * self.LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+def parse_xml_file(xml_file_path, clazz, parser=None, cache=None):
+    return parse_xml_string(Path(xml_file_path).read_text(), clazz, parser, cache)
+
+
+def parse_xml_string(xml_string, clazz, parser=None, cache=None):
     with warnings.catch_warnings():
         warnings.simplefilter("ignore", category=ConverterWarning)
-        xml_string = Path(xml_file_path).read_text()
-        parser = XmlParser()
-        return parser.from_string(xml_string, clazz)
+        if cache is not None:
+            obj = cache.get(xml_string, clazz)
+            if obj is not None:
+                return obj
+        if parser is None:
+            parser = get_xml_parser()
+        obj = parser.from_string(xml_string, clazz)
+        if cache is not None:
+            cache.put(xml_string, clazz, obj)
+        return obj
 
 
-def xml_to_rdf(root_path, module, output_path, partition_number=1):
-    """Converts all tehj XML files on a path to RDF"""
+# Paths of the values project_xml_file extracts by default: '/'-separated local element names below the Spase root
+# element, where '*' matches any element, e.g. the NumericalData or Observatory that holds a ResourceHeader
+HEADER_PATHS = (
+    'Version',
+    '*/ResourceID',
+    '*/ResourceHeader/ResourceName',
+    '*/ResourceHeader/AlternateName',
+    '*/ResourceHeader/DOI',
+    '*/ResourceHeader/ReleaseDate',
+)
 
-    g = Graph()
-    file_count = 0
-    current_out_file = 0
 
-    module = importlib.import_module(module)
-    spase_class = getattr(module, 'Spase')
-    # Get a list of all XML files in the specified path and its subdirectories
-    xml_files = glob.glob(os.path.join(root_path, '**/*.xml'), recursive=True)
+@lru_cache
+def _path_patterns(paths):
+    """Returns, by depth below the root element, the steps ending each path, and those ending its parent"""
+    patterns = {}
+    for path in paths:
+        steps = tuple(path.split('/'))
+        patterns.setdefault(len(steps), []).append((steps, path, False))
+        patterns.setdefault(len(steps) - 1, []).append((steps[:-1], path, True))
+    return patterns
 
-    # Determine the number of files for each output (one third of total files)
-    num_files = len(xml_files)
-    files_per_output = num_files // partition_number
 
-    # Iterate through XML files using tqdm for progress tracking
-    for xml_file in tqdm(xml_files, desc="Processing XML files"):
-        if "Deprecated" in xml_file or "sitemap" in xml_file:
+def _project(events, paths):
+    patterns = _path_patterns(tuple(paths))
+    pending = set(paths)
+    values = {}
+    names = []
+    for event, element in events:
+        if event == 'start':
+            names.append(element.tag.rsplit('}', 1)[-1])
             continue
+        for steps, path, parent in patterns.get(len(names) - 1, ()):
+            if parent and not len(element):
+                continue
+            if path in pending and all(step == '*' or step == name for step, name in zip(steps, names[1:])):
+                # A path is settled by its first match, or as missing once the first element with children that
+                # could be its parent has ended
+                pending.discard(path)
+                if not parent:
+                    values[path] = (element.text or '').strip()
+        if not pending:
+            break
+        names.pop()
+        element.clear()
+    return values
+
+
+def _pull_events(chunks):
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.read_events()
+
+
+def project_xml_file(xml_file_path, paths=HEADER_PATHS, chunk_size=4096):
+    """Returns the text of the first element at each of paths in a SPASE record, or None where there is none
+
+    The XML is streamed chunk_size bytes at a time rather than parsed into the model dataclasses, and only read
+    until every path is found or its first parent element, e.g. the first ResourceHeader, has ended.
+    """
+    with open(xml_file_path, 'rb') as f:
+        values = _project(_pull_events(iter(lambda: f.read(chunk_size), b'')), paths)
+    return {path: values.get(path) for path in paths}
+
+
+def project_xml_string(xml_string, paths=HEADER_PATHS, chunk_size=4096):
+    """project_xml_file for a record already read into a string"""
+    chunks = (xml_string[start:start + chunk_size] for start in range(0, len(xml_string), chunk_size))
+    values = _project(_pull_events(chunks), paths)
+    return {path: values.get(path) for path in paths}
+
+
+# Model modules by the SPASE schema version, or major.minor version, of the records they parse
+SCHEMA_MODELS = {}
+
+
+def register_model(version, module_name):
+    """Registers the model module that xml_to_rdf parses records of a schema version with, e.g. '2.3' or '2.3.1'"""
+    SCHEMA_MODELS[version] = module_name
+
+
+def sniff_schema_version(xml_string, chunk_size=4096):
+    """Returns the <Version> of a SPASE record, feeding the parser only as much of the XML as it takes to find it"""
+    return project_xml_string(xml_string, ('Version',), chunk_size)['Version']
+
+
+def resolve_model(version, models, default):
+    """Returns the model module for a schema version: an exact match in models, else one for its major.minor
+    version, else default
+    """
+    if version is None:
+        return default
+    if version in models:
+        return models[version]
+    return models.get('.'.join(version.split('.')[:2]), default)
+
+
+OUTPUT_EXTENSIONS = {
+    'turtle': 'ttl',
+    'nt': 'nt',
+    'nquads': 'nq',
+    'trig': 'trig',
+}
+# Formats that keep each record in a named graph of its own
+QUAD_FORMATS = ('nquads', 'trig')
+
+COMPRESSION_SUFFIXES = {
+    'gzip': '.gz',
+    'bz2': '.bz2',
+    'zstd': '.zst',
+}
+
+
+def _open_compressed(output_filename, compression=None, compression_level=None):
+    if compression is None:
+        return open(output_filename, 'wb')
+    if compression == 'gzip':
+        return gzip.open(output_filename, 'wb', compresslevel=9 if compression_level is None else compression_level)
+    if compression == 'bz2':
+        return bz2.open(output_filename, 'wb', compresslevel=9 if compression_level is None else compression_level)
+    if compression == 'zstd':
         try:
-            order = parse_xml_file(xml_file, spase_class)
-        except Exception as e:
-            print(f"Error processing {xml_file}: {e}")
-            continue
+            import zstandard
+        except ImportError:
+            raise ImportError("zstandard is not installed. Please install zstandard to write zstd compressed output.")
+        compressor = zstandard.ZstdCompressor(level=3 if compression_level is None else compression_level)
+        return compressor.stream_writer(open(output_filename, 'wb'), closefd=True)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+class _MeteredStream(io.RawIOBase):
+    """Counts the bytes written through it and the time spent compressing and writing them"""
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+        self.bytes_written = 0
+        self.seconds = 0.0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        start = time.perf_counter()
+        self.stream.write(b)
+        self.seconds += time.perf_counter() - start
+        self.bytes_written += len(b)
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            start = time.perf_counter()
+            self.stream.close()
+            self.seconds += time.perf_counter() - start
+        super().close()
+
+
+def open_output_stream(output_filename, compression=None, compression_level=None):
+    """Opens a buffered binary stream that compresses with the given codec as it is written
+
+    Returns the stream and the _MeteredStream under it, which reports the uncompressed bytes and compression time.
+    """
+    meter = _MeteredStream(_open_compressed(output_filename, compression, compression_level))
+    return io.BufferedWriter(meter, buffer_size=1 << 16), meter
+
+
+class NTriplesWriter:
+    """Streams triples straight to an N-Triples file instead of keeping them in a Graph
+
+    It can be passed to rdfize_obj in place of a Graph, or fed from iter_obj_triples with write_triples.
+    """
+
+    def __init__(self, destination, compression=None, compression_level=None):
+        self.destination = destination
+        self.triple_count = 0
+        stream, self.meter = open_output_stream(destination, compression, compression_level)
+        self._file = io.TextIOWrapper(stream, encoding='utf-8')
+
+    def add(self, triple):
+        self._file.write(_nt_row(triple))
+        self.triple_count += 1
+
+    def addN(self, quads):
+        for s, p, o, _ in quads:
+            self.add((s, p, o))
+
+    def write_triples(self, triples):
+        for triple in triples:
+            self.add(triple)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 
+class NQuadsWriter(NTriplesWriter):
+    """Streams quads straight to an N-Quads file, keeping each record in its own named graph"""
+
+    def add_quad(self, quad):
+        self._file.write(_nq_row(quad[:3], quad[3]))
+        self.triple_count += 1
+
+    def addN(self, quads):
+        for s, p, o, c in quads:
+            self.add_quad((s, p, o, c.identifier if isinstance(c, Graph) else c))
+
+    def write_quads(self, quads):
+        for quad in quads:
+            self.add_quad(quad)
+
+
+def record_graph_uri(triples, xml_file):
+    """Returns the IRI of the named graph holding a record's triples
+
+    A record describing a single resource is named after the resource id, so a new version of the record
+    replaces the same graph even if the file moves; otherwise the name is derived from the file's path.
+    """
+    # The walk starts with the Spase root node, which links to the resources of the record
+    root = triples[0][0] if triples else None
+    resources = {o for s, p, o in triples if s == root}
+    resource_uris = {s for s, p, o in triples if p == DC.identifier and s in resources}
+    if len(resource_uris) == 1:
+        return URIRef(f"http://www.spase-group.org/data/graph/{resource_uris.pop().rsplit('/', 1)[1]}")
+    return URIRef(f"http://www.spase-group.org/data/graph/file/{quote(Path(xml_file).as_posix())}")
+
+
+STAGES = ('read', 'parse', 'rdfize', 'serialize')
+
+
+@contextmanager
+def _timed(timings, stage, memory=None):
+    """Adds the wall and CPU seconds spent in the block to timings[stage], and tracks its memory if profiling"""
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        if memory is not None:
+            with memory.stage(stage):
+                yield
+        else:
+            yield
+    finally:
+        seconds = timings.setdefault(stage, [0.0, 0.0])
+        seconds[0] += time.perf_counter() - start
+        seconds[1] += time.process_time() - cpu_start
+
+
+MIN_PROJECTION_RECORDS = 10
+
+
+class MemoryProfiler:
+    """Tracks the memory of an xml_to_rdf run with tracemalloc
+
+    Each stage records the largest peak it reached above the memory in use when it started. Every
+    sample_interval-th run of a stage is also snapshotted, and the allocation sites that grew the most over
+    the sampled runs are reported as its top allocations. Shards being collected are checked against budget
+    (in bytes): once their memory, projected from the bytes per triple so far, would exceed it, a warning is
+    printed.
+
+    Only the main process is traced, so with workers > 1 the read, parse and rdfize stages are not covered.
+    """
+
+    def __init__(self, budget=None, top=10, sample_interval=100):
+        self.budget = budget
+        self.top = top
+        self.sample_interval = sample_interval
+        self.stage_peaks = {stage: 0 for stage in STAGES}
+        self.stage_runs = {stage: 0 for stage in STAGES}
+        self.stage_allocations = {stage: {} for stage in STAGES}
+        self.max_graph_triples = 0
+        self.peak = 0
+        self.warned_shards = set()
+        self._shard_start = 0
+
+    def start(self):
+        tracemalloc.start()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    @contextmanager
+    def stage(self, stage):
+        self.stage_runs[stage] += 1
+        before = self._snapshot() if (self.stage_runs[stage] - 1) % self.sample_interval == 0 else None
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1]
+            # Stages reset the traced peak, so the overall one is kept here
+            self.peak = max(self.peak, peak)
+            self.stage_peaks[stage] = max(self.stage_peaks[stage], peak - start)
+            if before is not None:
+                allocations = self.stage_allocations[stage]
+                for stat in self._snapshot().compare_to(before, 'lineno')[:self.top]:
+                    site = str(stat.traceback)
+                    allocations[site] = allocations.get(site, 0) + stat.size_diff
+
+    def start_shard(self):
+        self._shard_start = tracemalloc.get_traced_memory()[0]
+
+    def check_shard(self, output_filename, records, graph_triples, expected_records=None, expected_triples=None):
+        """Warns once per shard when its memory, projected to its expected size, exceeds the budget"""
+        self.max_graph_triples = max(self.max_graph_triples, graph_triples)
+        if self.budget is None or output_filename in self.warned_shards or not records:
+            return
+        used = tracemalloc.get_traced_memory()[0] - self._shard_start
+        # The first records of a shard are too few to extrapolate from
+        if records < MIN_PROJECTION_RECORDS:
+            projected = used
+        elif graph_triples and expected_triples is not None:
+            projected = used / graph_triples * expected_triples
+        elif expected_records is not None:
+            projected = used / records * expected_records
+        else:
+            projected = used
+        if projected > self.budget:
+            self.warned_shards.add(output_filename)
+            print(f"Warning: {os.path.basename(output_filename)} is projected to need {projected / 1e6:.1f} MB, "
+                  f"over the memory budget of {self.budget / 1e6:.1f} MB; use a larger partition_number, "
+                  f"max_triples_per_shard or output_format='nt' or 'nquads'")
+
+    def summary(self):
+        current, peak = tracemalloc.get_traced_memory()
+        summary = {
+            'traced_current_bytes': current,
+            'traced_peak_bytes': max(self.peak, peak),
+            'max_graph_triples': self.max_graph_triples,
+            'stages': {stage: {'peak_bytes': self.stage_peaks[stage],
+                               'top_allocations': [{'site': site, 'bytes': size} for site, size in
+                                                   sorted(allocations.items(), key=lambda item: -item[1])[:self.top]]}
+                       for stage, allocations in self.stage_allocations.items()},
+        }
         try:
-            rdfize_obj(order, g)
-            file_count += 1
-        except Exception as e:
-            print(f"Error rdfizing {xml_file}: {e}")
+            import resource
+            # ru_maxrss is in kilobytes on Linux
+            summary['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            pass
+        return summary
+
+
+class ConversionStats:
+    """Per-stage wall and CPU times, throughput and the slowest files of an xml_to_rdf run
+
+    The read, parse and rdfize stages run per file, in the pool workers if there are any, so their times are summed
+    over the workers and can add up to more than the wall time of the run. The serialize stage covers collecting
+    the records into the shards and writing them.
+    """
+
+    def __init__(self, slowest_files=10, memory=None):
+        self.timings = {stage: [0.0, 0.0] for stage in STAGES}
+        self.memory = memory
+        self.records = 0
+        self.errors = 0
+        self.triples = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.slowest_files = slowest_files
+        self._slowest = []
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def add_file(self, xml_file, timings, triple_count=None):
+        """Counts a converted file, or a failed one if triple_count is None"""
+        seconds = 0.0
+        for stage in STAGES:
+            if stage in timings:
+                self.timings[stage][0] += timings[stage][0]
+                self.timings[stage][1] += timings[stage][1]
+                seconds += timings[stage][0]
+        self.bytes_read += timings.get('bytes_read', 0)
+        if triple_count is None:
+            self.errors += 1
+        else:
+            self.records += 1
+            self.triples += triple_count
+        # Min-heap of the slowest files seen so far
+        if len(self._slowest) < self.slowest_files:
+            heapq.heappush(self._slowest, (seconds, xml_file))
+        elif self._slowest and seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (seconds, xml_file))
+
+    def summary(self):
+        wall_seconds = time.perf_counter() - self._start
+        return {
+            'records': self.records,
+            'errors': self.errors,
+            'triples': self.triples,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': time.process_time() - self._cpu_start,
+            'records_per_second': self.records / max(wall_seconds, 1e-9),
+            'triples_per_second': self.triples / max(wall_seconds, 1e-9),
+            'stages': {stage: {'wall_seconds': wall, 'cpu_seconds': cpu}
+                       for stage, (wall, cpu) in self.timings.items()},
+            'slowest_files': [{'file': xml_file, 'seconds': seconds}
+                              for seconds, xml_file in sorted(self._slowest, reverse=True)],
+            **({'memory': self.memory.summary()} if self.memory is not None else {}),
+        }
+
+
+@lru_cache(maxsize=None)
+def _spase_class(module_name):
+    """Returns the root Spase class of a model module, importing it the first time"""
+    return getattr(importlib.import_module(module_name), 'Spase')
+
+
+def _rdfize_xml_file(xml_file, module_name, deterministic_ids=False, cache=None, memory=None, models=None):
+    """Parses and RDF-izes a single XML file, returning its triples, an error message (if any) and its stage timings
+
+    If models maps schema versions to model modules, the file is parsed with the one for its <Version>, and
+    with module_name if there is none.
+    """
+    timings = {}
+    try:
+        with _timed(timings, 'read', memory):
+            xml_string = Path(xml_file).read_text()
+            timings['bytes_read'] = os.path.getsize(xml_file)
+            if models:
+                module_name = resolve_model(sniff_schema_version(xml_string), models, module_name)
+        spase_class = _spase_class(module_name)
+        with _timed(timings, 'parse', memory):
+            order = parse_xml_string(xml_string, spase_class, cache=cache)
+    except Exception as e:
+        return None, f"Error processing {xml_file}: {e}", timings
+
+    try:
+        with _timed(timings, 'rdfize', memory):
+            triples = list(iter_obj_triples(order, deterministic_ids=deterministic_ids))
+    except Exception as e:
+        return None, f"Error rdfizing {xml_file}: {e}", timings
+    return triples, None, timings
+
+
+def _pack_triples(triples):
+    """Replaces literals by their lexical parts before pickling
+
+    Unpickling a Literal re-normalizes its lexical form (e.g. 'Z' becomes '+00:00'), so _unpack_triples
+    rebuilds them with normalize=False to get back the exact same terms.
+    """
+    return [(s, p, (str(o), o.language, o.datatype) if isinstance(o, Literal) else o) for s, p, o in triples]
+
+
+def _unpack_triples(triples):
+    return [(s, p, Literal(*o, normalize=False) if isinstance(o, tuple) else o) for s, p, o in triples]
+
+
+def _rdfize_xml_files_in_worker(xml_files, module, deterministic_ids, cache, models):
+    """Runs _rdfize_xml_file on a chunk of files in a pool worker, sending the triples back packed along with the
+    bytes the chunk wrote to the cache
+    """
+    results = []
+    cache_bytes = cache.bytes_written if cache is not None else 0
+    for xml_file in xml_files:
+        triples, error, timings = _rdfize_xml_file(xml_file, module, deterministic_ids, cache, models=models)
+        results.append(((None if triples is None else _pack_triples(triples)), error, timings))
+    return results, (cache.bytes_written - cache_bytes if cache is not None else 0)
+
+
+WORKER_CHUNK_SIZE = 16
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _convert_xml_files(xml_files, module, workers=1, deterministic_ids=False, cache=None, memory=None, models=None):
+    """Yields each XML file with its triples (or error message) and stage timings in order, using a process pool if
+    workers > 1
+
+    xml_files may be a lazy iterable; only a few chunks per worker are submitted ahead of the results.
+    """
+    if workers <= 1:
+        for xml_file in xml_files:
+            yield (xml_file, *_rdfize_xml_file(xml_file, module, deterministic_ids, cache, memory, models))
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for chunk in _chunks(xml_files, WORKER_CHUNK_SIZE):
+            pending.append((chunk, executor.submit(_rdfize_xml_files_in_worker, chunk, module, deterministic_ids,
+                                                   cache, models)))
+            if len(pending) > 2 * workers:
+                yield from _unpack_chunk(*pending.popleft(), cache)
+        while pending:
+            yield from _unpack_chunk(*pending.popleft(), cache)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _unpack_chunk(chunk, future, cache=None):
+    results, cache_bytes = future.result()
+    # Each chunk gets its own copy of the cache, so only the parent sees the size of what all the workers wrote
+    if cache is not None:
+        cache.account(cache_bytes)
+    for xml_file, (triples, error, timings) in zip(chunk, results):
+        yield xml_file, (None if triples is None else _unpack_triples(triples)), error, timings
+
+
+DEFAULT_INCLUDE = ('*.xml',)
+DEFAULT_EXCLUDE = ('*Deprecated*', '*sitemap*')
+
+
+def iter_xml_files(root_path, include=DEFAULT_INCLUDE, exclude=DEFAULT_EXCLUDE):
+    """Yields the files under root_path whose names match include, in sorted order
+
+    Files and directories whose names match exclude are skipped, and excluded directories are not walked at all.
+    """
+    stack = [root_path]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Error listing {directory}: {e}")
+            continue
+        subdirectories = []
+        for entry in entries:
+            if any(fnmatch(entry.name, pattern) for pattern in exclude):
+                continue
+            if entry.is_dir():
+                subdirectories.append(entry.path)
+            elif any(fnmatch(entry.name, pattern) for pattern in include):
+                yield entry.path
+        # Walk the subdirectories depth-first, in name order
+        stack.extend(reversed(subdirectories))
+
+
+class _ShardWriter:
+    """Writes converted records to the numbered output shards of xml_to_rdf and lists them in SHARDS_FILE"""
+
+    def __init__(self, output_path, output_format, single_file=False, compression=None, compression_level=None,
+                 checkpoint_options=None, stats=None):
+        self.output_path = output_path
+        self.output_format = output_format
+        self.single_file = single_file
+        self.compression = compression
+        self.compression_level = compression_level
+        self.checkpoint_options = checkpoint_options
+        self.stats = stats if stats is not None else ConversionStats()
+        self.shards = []
+        self.records = 0
+        self.triples = 0
+        self._g = None
+        self._writer = None
+        self._pending_files = []
+        self._checkpoint_started = False
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.output_path, CHECKPOINT_FILE)
+
+    def resume(self):
+        """Continues after the shards of the last checkpoint, returning the files they already cover"""
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as f:
+            lines = f.read().splitlines()
+        if not lines or json.loads(lines[0]).get('options') != self.checkpoint_options:
+            print("Checkpoint was written with other options, starting over")
+            return set()
+        entries = []
+        for line in lines[1:]:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # The last line may have been cut short by the interruption
+                break
+        self.shards = [entry['shard'] for entry in entries if entry['shard'] is not None]
+        done_files = [xml_file for entry in entries for xml_file in entry['files']]
+        # Drop any cut short line, so the checkpoint can be appended to again
+        with open(self.checkpoint_path, 'w') as f:
+            f.writelines(line + '\n' for line in lines[:len(entries) + 1])
+        self._checkpoint_started = True
+        print(f"Resuming after {len(self.shards)} shards and {len(done_files)} files")
+        return set(done_files)
+
+    def skip_file(self, xml_file):
+        """Marks a file that produced no record as done once the current shard is flushed"""
+        self._pending_files.append(xml_file)
+
+    def filename(self, shard):
+        extension = OUTPUT_EXTENSIONS[self.output_format]
+        if self.compression:
+            extension += COMPRESSION_SUFFIXES[self.compression]
+        return f'{self.output_path}/spase.{extension}' if self.single_file else f'{self.output_path}/spase_{shard}.{extension}'
+
+    def add_record(self, triples, xml_file=None, expected_records=None, expected_triples=None, graph=None):
+        """Adds a record's triples to the current shard, in the named graph graph for quad formats"""
+        if xml_file is not None:
+            self._pending_files.append(xml_file)
+        memory = self.stats.memory
+        if memory is not None and not self.records:
+            memory.start_shard()
+        with _timed(self.stats.timings, 'serialize', memory):
+            self._add_record(triples, graph)
+        self.records += 1
+        if memory is not None:
+            memory.check_shard(self.filename(len(self.shards) + 1), self.records,
+                               self.triples if self._g is not None else 0, expected_records, expected_triples)
+
+    def _add_record(self, triples, graph=None):
+        if self.output_format == 'nt':
+            if self._writer is None:
+                self._writer = NTriplesWriter(self.filename(len(self.shards) + 1), self.compression,
+                                              self.compression_level)
+            self._writer.write_triples(triples)
+            self.triples = self._writer.triple_count
+        elif self.output_format == 'nquads':
+            if self._writer is None:
+                self._writer = NQuadsWriter(self.filename(len(self.shards) + 1), self.compression,
+                                            self.compression_level)
+            self._writer.write_quads((s, p, o, graph) for s, p, o in triples)
+            self.triples = self._writer.triple_count
+        elif self.output_format == 'trig':
+            if self._g is None:
+                self._g = Dataset()
+            record_graph = self._g.graph(graph)
+            record_graph.addN((s, p, o, record_graph) for s, p, o in triples)
+            # Every record has a graph of its own, so nothing is deduplicated across records
+            self.triples += len(triples)
+        else:
+            if self._g is None:
+                self._g = _shard_graph()
+            self.triples += _add_new_triples(self._g, triples)
+
+    def flush(self):
+        """Finishes the current shard, if it has any records, and checkpoints the files it covers"""
+        if not self.records:
+            self._checkpoint(None)
+            return
+        output_filename = self.filename(len(self.shards) + 1)
+        with _timed(self.stats.timings, 'serialize', self.stats.memory):
+            if self._writer is not None:
+                self._writer.close()
+                meter = self._writer.meter
+                self._writer = None
+            else:
+                meter = _serialize_graph(self._g, output_filename, self.output_format, self.compression,
+                                         self.compression_level)
+                # Clear the graph to start a new one for the next batch
+                self._g = None
+        self.shards.append(_shard_info(output_filename, self.records, self.triples, meter, self.compression))
+        self.stats.bytes_written += self.shards[-1]['bytes']
+        self.records = 0
+        self.triples = 0
+        self._checkpoint(self.shards[-1])
+
+    def _checkpoint(self, shard):
+        """Appends the shard just flushed (None if it had no records) and the files it covers to the checkpoint
+
+        The checkpoint is a JSON Lines log, starting with the options of the run, so each flush writes only
+        its own files.
+        """
+        if self.checkpoint_options is None or not self._pending_files:
+            return
+        with open(self.checkpoint_path, 'a' if self._checkpoint_started else 'w') as f:
+            if not self._checkpoint_started:
+                f.write(json.dumps({'options': self.checkpoint_options}, sort_keys=True) + '\n')
+            f.write(json.dumps({'shard': shard, 'files': self._pending_files}, sort_keys=True) + '\n')
+        self._checkpoint_started = True
+        self._pending_files = []
+
+    def close(self):
+        self.flush()
+        _write_json(os.path.join(self.output_path, SHARDS_FILE), {'shards': self.shards})
+        # The run is complete, so there is nothing left to resume
+        if self.checkpoint_options is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+def _shard_graph():
+    """Returns a Graph for collecting a shard
+
+    The SimpleMemory store skips the per-context indexes of the default store, which shards do not need,
+    and takes bulk insertions several times faster.
+    """
+    return Graph(store='SimpleMemory')
+
+
+def _add_new_triples(g, triples):
+    """Adds the triples not already in g to it, returning how many there were
+
+    The SimpleMemory store counts its triples by walking them all, so shards keep a running count instead.
+    """
+    new_triples = [triple for triple in dict.fromkeys(triples) if triple not in g]
+    g.addN((s, p, o, g) for s, p, o in new_triples)
+    return len(new_triples)
+
+
+def _serialize_graph(g, output_filename, output_format='turtle', compression=None, compression_level=None):
+    stream, meter = open_output_stream(output_filename, compression, compression_level)
+    with stream:
+        g.serialize(destination=stream, format=output_format, encoding='utf-8')
+    return meter
+
+
+def _shard_info(output_filename, records, triples, meter, compression=None):
+    info = {'file': os.path.basename(output_filename), 'records': records, 'triples': triples,
+            'bytes': os.path.getsize(output_filename)}
+    if compression:
+        info['uncompressed_bytes'] = meter.bytes_written
+        info['compression_ratio'] = meter.bytes_written / max(info['bytes'], 1)
+        info['compression_mb_per_second'] = meter.bytes_written / 1e6 / max(meter.seconds, 1e-9)
+        print(f"{info['file']}: compressed {info['uncompressed_bytes']} to {info['bytes']} bytes "
+              f"(ratio {info['compression_ratio']:.1f}, {info['compression_mb_per_second']:.1f} MB/s)")
+    return info
+
+
+def _write_shard(triples, output_filename, output_format, compression=None, compression_level=None):
+    """Writes a whole shard at once, returning the number of triples in it and the output meter
+
+    For quad formats triples are (s, p, o, graph IRI) quads.
+    """
+    if output_format == 'nt':
+        with NTriplesWriter(output_filename, compression, compression_level) as writer:
+            writer.write_triples(dict.fromkeys(triples))
+        return writer.triple_count, writer.meter
+    if output_format == 'nquads':
+        with NQuadsWriter(output_filename, compression, compression_level) as writer:
+            writer.write_quads(dict.fromkeys(triples))
+        return writer.triple_count, writer.meter
+    if output_format == 'trig':
+        g = Dataset()
+        quads = dict.fromkeys(triples)
+        for s, p, o, graph in quads:
+            g.graph(graph).add((s, p, o))
+        return len(quads), _serialize_graph(g, output_filename, output_format, compression, compression_level)
+    g = _shard_graph()
+    g.addN((s, p, o, g) for s, p, o in triples)
+    return len(g), _serialize_graph(g, output_filename, output_format, compression, compression_level)
+
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _write_json(path, data):
+    """Writes JSON through a temporary file so an interrupted run never leaves a truncated file behind"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+MANIFEST_FILE = 'spase_manifest.json'
+SHARDS_FILE = 'spase_shards.json'
+CHECKPOINT_FILE = 'spase_checkpoint.jsonl'
+STATS_FILE = 'spase_stats.json'
+RECORDS_DIR = '.spase_records'
+
+
+def _xml_to_rdf_incremental(xml_files, *, root_path, module, output_path, partition_number, workers, output_format,
+                            deterministic_ids, max_triples_per_shard, compression, compression_level, cache, stats,
+                            stats_callback=None, models=None):
+    """Re-RDF-izes only new or changed files and rewrites the shards whose records changed
+
+    The manifest keeps the mtime, size, content hash and shard of every converted file, and the triples of each
+    record are kept in RECORDS_DIR so the affected shards can be rebuilt without converting their other records.
+    """
+    manifest_path = os.path.join(output_path, MANIFEST_FILE)
+    records_path = os.path.join(output_path, RECORDS_DIR)
+    os.makedirs(records_path, exist_ok=True)
+    options = {'module': module, 'output_format': output_format, 'partition_number': partition_number,
+               'max_triples_per_shard': max_triples_per_shard, 'deterministic_ids': deterministic_ids,
+               'compression': compression}
+    # Only recorded when set, so manifests from before version dispatch stay valid
+    if models:
+        options['models'] = models
+    shard_writer = _ShardWriter(output_path, output_format,
+                                single_file=partition_number == 1 and not max_triples_per_shard,
+                                compression=compression, compression_level=compression_level)
+
+    manifest = {'options': options, 'files': {}, 'shards': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    # Records converted with other options can not be reused, so start over, without the shards and records of the
+    # old options, which would otherwise be loaded alongside the new ones
+    if manifest['options'] != options:
+        for info in manifest['shards'].values():
+            old_filename = os.path.join(output_path, info['file'])
+            if os.path.exists(old_filename):
+                os.remove(old_filename)
+        shutil.rmtree(records_path)
+        os.makedirs(records_path)
+        manifest = {'options': options, 'files': {}, 'shards': {}}
+    old_entries = manifest['files']
+    shards = {int(shard): info for shard, info in manifest['shards'].items()}
+
+    def record_path(key):
+        return os.path.join(records_path, hashlib.sha1(key.encode()).hexdigest() + '.pickle')
+
+    entries = {}
+    to_convert = []
+    for xml_file in xml_files:
+        key = os.path.relpath(xml_file, root_path)
+        stat = os.stat(xml_file)
+        entry = old_entries.get(key)
+        if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            entries[key] = entry
+            continue
+        sha256 = _file_sha256(xml_file)
+        if entry and entry['sha256'] == sha256:
+            entries[key] = dict(entry, mtime=stat.st_mtime_ns, size=stat.st_size)
             continue
+        to_convert.append((xml_file, key, {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': sha256,
+                                           'shard': entry['shard'] if entry else None}))
+
+    changed_shards = set()
+    deleted = old_entries.keys() - {key for _, key, _ in to_convert} - entries.keys()
+    for key in deleted:
+        if old_entries[key]['shard'] is not None:
+            changed_shards.add(old_entries[key]['shard'])
+        if os.path.exists(record_path(key)):
+            os.remove(record_path(key))
+
+    unchanged = len(entries)
+    shard_records = {shard: 0 for shard in range(1, partition_number + 1)} if not max_triples_per_shard else {}
+    shard_triples = {}
+    for entry in entries.values():
+        if entry['shard'] is not None:
+            shard_records[entry['shard']] = shard_records.get(entry['shard'], 0) + 1
+            shard_triples[entry['shard']] = shard_triples.get(entry['shard'], 0) + entry['triples']
+
+    results = _convert_xml_files([xml_file for xml_file, _, _ in to_convert], module, workers, deterministic_ids,
+                                 cache, stats.memory, models)
+    # Changed records that had a shard, and new records, which are placed once all the former are counted
+    kept = []
+    to_place = []
+    for (xml_file, key, entry), (_, triples, error, timings) in tqdm(zip(to_convert, results), total=len(to_convert),
+                                                                     desc="Processing XML files"):
+        if entry['shard'] is not None:
+            changed_shards.add(entry['shard'])
+        if error:
+            print(error)
+            stats.add_file(key, timings)
+            if stats_callback is not None:
+                stats_callback(stats)
+            if os.path.exists(record_path(key)):
+                os.remove(record_path(key))
+            # Keep failed files in the manifest too, so they are only retried once they change
+            entries[key] = dict(entry, shard=None, error=error)
+            continue
+
+        triples = list(dict.fromkeys(triples))
+        stats.add_file(key, timings, len(triples))
+        if stats_callback is not None:
+            stats_callback(stats)
+        with open(record_path(key), 'wb') as f:
+            pickle.dump(_pack_triples(triples), f, protocol=pickle.HIGHEST_PROTOCOL)
+        entry['triples'] = len(triples)
+        entries[key] = entry
+        if entry['shard'] is not None:
+            kept.append(entry)
+        else:
+            to_place.append(entry)
+
+    # Changed records keep their shard while it still has room for their new triples, and are counted in before
+    # any other record is placed
+    for entry in kept:
+        if max_triples_per_shard and shard_triples.get(entry['shard'], 0) + entry['triples'] > max_triples_per_shard:
+            entry['shard'] = None
+            to_place.append(entry)
+            continue
+        shard_records[entry['shard']] = shard_records.get(entry['shard'], 0) + 1
+        shard_triples[entry['shard']] = shard_triples.get(entry['shard'], 0) + entry['triples']
+    for entry in to_place:
+        if max_triples_per_shard:
+            # First shard with room left for the record, or a new one
+            entry['shard'] = next((shard for shard in sorted(shard_triples)
+                                   if shard_triples[shard] + entry['triples'] <= max_triples_per_shard),
+                                  max(shard_triples, default=0) + 1)
+        else:
+            entry['shard'] = min(shard_records, key=shard_records.get)
+        shard_records[entry['shard']] = shard_records.get(entry['shard'], 0) + 1
+        shard_triples[entry['shard']] = shard_triples.get(entry['shard'], 0) + entry['triples']
+        changed_shards.add(entry['shard'])
+
+    for shard in sorted(changed_shards):
+        output_filename = shard_writer.filename(shard)
+        keys = sorted(key for key, entry in entries.items() if entry['shard'] == shard)
+        if not keys:
+            shards.pop(shard, None)
+            if os.path.exists(output_filename):
+                os.remove(output_filename)
+            continue
+        triples = []
+        for key in keys:
+            with open(record_path(key), 'rb') as f:
+                record_triples = _unpack_triples(pickle.load(f))
+            if output_format in QUAD_FORMATS:
+                graph = record_graph_uri(record_triples, key)
+                record_triples = [(s, p, o, graph) for s, p, o in record_triples]
+            triples.extend(record_triples)
+        with _timed(stats.timings, 'serialize', stats.memory):
+            triple_count, meter = _write_shard(triples, output_filename, output_format, compression, compression_level)
+        shards[shard] = _shard_info(output_filename, len(keys), triple_count, meter, compression)
+        stats.bytes_written += shards[shard]['bytes']
+
+    _write_json(manifest_path, {'options': options, 'files': entries, 'shards': shards})
+    _write_json(os.path.join(output_path, SHARDS_FILE), {'shards': [shards[shard] for shard in sorted(shards)]})
+    print(f"Incremental conversion: {len(to_convert)} new or changed, {len(deleted)} deleted, "
+          f"{unchanged} unchanged files; rewrote shards {sorted(changed_shards)}")
+
+
+def xml_to_rdf(root_path, module, output_path, partition_number=1, workers=1, output_format='turtle',
+               deterministic_ids=False, incremental=False, max_triples_per_shard=None, compression=None,
+               compression_level=None, checkpoint=True, resume=False, cache_dir=None, cache_max_bytes=1 << 30,
+               include=DEFAULT_INCLUDE, exclude=DEFAULT_EXCLUDE, stats_callback=None, slowest_files=10,
+               memory_profile=False, memory_budget=None, models=None):
+    """Converts all tehj XML files on a path to RDF
+
+    The files are found by iter_xml_files with the include and exclude name patterns, and conversion starts
+    as soon as the first one is found, unless partition_number > 1 needs the file count up front.
+
+    The output is split into partition_number shards by file count, or, if max_triples_per_shard is
+    given, into as many shards as needed to keep each under that many triples (a record is never split).
+    The shards are listed in SHARDS_FILE.
+
+    With workers > 1 the files are parsed and RDF-ized in a pool of that many processes, and their
+    triples are merged into the output partitions in file order.
+
+    output_format='nt' streams N-Triples to disk record by record instead of collecting each
+    partition in a Graph and serializing it as Turtle, so memory use does not grow with the partition.
+    output_format='nquads' (streamed the same way) or 'trig' puts the triples of each XML file in a named
+    graph of its own (see record_graph_uri), so a triplestore can replace a single record by its graph.
+
+    deterministic_ids=True derives the IRIs of nested nodes from their content instead of random UUIDs,
+    so re-converting an unchanged record yields identical triples.
+
+    incremental=True keeps a manifest of the converted files in output_path, and on later runs only
+    re-RDF-izes new or changed files and drops the triples of deleted ones.
+
+    compression ('gzip', 'bz2' or 'zstd') compresses the shards as they are written, at compression_level
+    if given, and reports the compression ratio and throughput of each shard.
+
+    With checkpoint=True every flushed shard is recorded in CHECKPOINT_FILE together with the files it
+    covers, and resume=True continues an interrupted run after its last checkpoint. Only the records
+    of the unflushed shard are converted again, so a small max_triples_per_shard bounds the work lost.
+
+    cache_dir keeps the parsed record trees in a ParsedRecordCache of at most cache_max_bytes, so
+    unchanged files skip the xsdata parse on later runs.
+
+    The run is timed per stage in a ConversionStats, which is passed to stats_callback (if given) after every
+    file. Its summary, with the slowest_files slowest files, is printed and written to STATS_FILE at the end
+    and returned.
+
+    memory_profile=True traces the run with a MemoryProfiler and adds the peak RSS, the largest live shard
+    Graph and the peak and top allocation sites of each stage to the summary. memory_budget (in bytes, which
+    implies memory_profile) warns when a shard is projected to need more memory than that.
+
+    Records are parsed with the model module registered for their schema <Version> in SCHEMA_MODELS (see
+    register_model) or in models, a {version: module name} mapping that takes precedence, and with module if
+    neither has one. The version is sniffed from the start of each file before the full parse.
+    """
+    if output_format not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if compression is not None and compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unsupported compression: {compression}")
+
+    models = {**SCHEMA_MODELS, **(models or {})}
+    # Import the model modules up front, so a bad module name fails the run instead of every file
+    for module_name in sorted({module, *models.values()}):
+        _spase_class(module_name)
+    # Walk the XML files in the specified path and its subdirectories
+    xml_files = iter_xml_files(root_path, include, exclude)
+    cache = ParsedRecordCache(cache_dir, cache_max_bytes) if cache_dir else None
+    memory = MemoryProfiler(memory_budget) if memory_profile or memory_budget else None
+    stats = ConversionStats(slowest_files, memory)
+    if memory is not None:
+        memory.start()
+    try:
+        return _xml_to_rdf(xml_files, root_path=root_path, module=module, output_path=output_path,
+                           partition_number=partition_number, workers=workers, output_format=output_format,
+                           deterministic_ids=deterministic_ids, incremental=incremental,
+                           max_triples_per_shard=max_triples_per_shard, compression=compression,
+                           compression_level=compression_level, checkpoint=checkpoint, resume=resume, cache=cache,
+                           include=include, exclude=exclude, stats=stats, stats_callback=stats_callback, models=models)
+    finally:
+        if memory is not None:
+            memory.stop()
+
+
+def _xml_to_rdf(xml_files, *, root_path, module, output_path, partition_number, workers, output_format,
+                deterministic_ids, incremental, max_triples_per_shard, compression, compression_level, checkpoint,
+                resume, cache, include, exclude, stats, stats_callback, models):
+    """Runs xml_to_rdf once its options are checked and its stats are set up
+
+    Takes the options by keyword only, as there are too many to pass by position safely.
+    """
+    if incremental:
+        if resume:
+            raise ValueError("resume is not supported for incremental conversions")
+        _xml_to_rdf_incremental(list(xml_files), root_path=root_path, module=module, output_path=output_path,
+                                partition_number=partition_number, workers=workers, output_format=output_format,
+                                deterministic_ids=deterministic_ids, max_triples_per_shard=max_triples_per_shard,
+                                compression=compression, compression_level=compression_level, cache=cache,
+                                stats=stats, stats_callback=stats_callback, models=models)
+        return _write_stats(stats, output_path)
+
+    # Determine the number of files for each output, rounding up so there are at most partition_number of them
+    total = None
+    files_per_output = None
+    if partition_number > 1 and not max_triples_per_shard:
+        xml_files = list(xml_files)
+        total = len(xml_files)
+        files_per_output = max(1, -(-total // partition_number))
+    elif stats.memory is not None and stats.memory.budget is not None and not max_triples_per_shard:
+        # Projecting the memory of the single output needs its record count
+        xml_files = list(xml_files)
+        total = files_per_output = len(xml_files)
+    checkpoint_options = None
+    if checkpoint or resume:
+        checkpoint_options = {'root_path': os.path.abspath(root_path), 'module': module,
+                              'output_format': output_format, 'partition_number': partition_number,
+                              'max_triples_per_shard': max_triples_per_shard, 'deterministic_ids': deterministic_ids,
+                              'compression': compression, 'include': list(include), 'exclude': list(exclude)}
+        if models:
+            checkpoint_options['models'] = models
+    shard_writer = _ShardWriter(output_path, output_format,
+                                single_file=partition_number == 1 and not max_triples_per_shard,
+                                compression=compression, compression_level=compression_level,
+                                checkpoint_options=checkpoint_options, stats=stats)
+    if resume:
+        done_files = shard_writer.resume()
+        xml_files = (xml_file for xml_file in xml_files if os.path.relpath(xml_file, root_path) not in done_files)
+        if total is not None:
+            xml_files = list(xml_files)
+            total = len(xml_files)
+
+    results = _convert_xml_files(xml_files, module, workers, deterministic_ids, cache, stats.memory, models)
+    try:
+        # Iterate through converted XML files using tqdm for progress tracking
+        for xml_file, triples, error, timings in tqdm(results, total=total, desc="Processing XML files"):
+            xml_file = os.path.relpath(xml_file, root_path)
+            if error:
+                print(error)
+                shard_writer.skip_file(xml_file)
+                stats.add_file(xml_file, timings)
+                if stats_callback is not None:
+                    stats_callback(stats)
+                continue
+
+            # Drop the duplicates a Graph would have absorbed, e.g. repeated rdf:type triples of references
+            triples = list(dict.fromkeys(triples))
+            stats.add_file(xml_file, timings, len(triples))
+            if stats_callback is not None:
+                stats_callback(stats)
+            graph = record_graph_uri(triples, xml_file) if output_format in QUAD_FORMATS else None
+            if max_triples_per_shard:
+                if shard_writer.records and shard_writer.triples + len(triples) > max_triples_per_shard:
+                    shard_writer.flush()
+                shard_writer.add_record(triples, xml_file, expected_triples=max_triples_per_shard, graph=graph)
+            else:
+                shard_writer.add_record(triples, xml_file, expected_records=files_per_output, graph=graph)
+                if shard_writer.records == files_per_output:
+                    shard_writer.flush()
+    finally:
+        results.close()
+    shard_writer.close()
+    return _write_stats(stats, output_path)
+
 
-        if file_count % files_per_output == 0:
-            current_out_file += 1
-            output_filename = f'{output_path}/spase_{current_out_file}.ttl' if partition_number > 1 else f'{output_path}/spase.ttl'
-            g.serialize(destination=output_filename, format='turtle')
-            # Clear the graph to start a new one for the next batch
-            g = Graph()
-
-    # Serialize any remaining data in the graph after processing all XML files
-    if g:
-        current_out_file += 1
-        output_filename = f'{output_path}/spase_{current_out_file}.ttl'
-        g.serialize(destination=output_filename, format='turtle')
+def _write_stats(stats, output_path):
+    summary = stats.summary()
+    _write_json(os.path.join(output_path, STATS_FILE), summary)
+    print(json.dumps(summary, indent=2))
+    return summary